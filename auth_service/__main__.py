@@ -1,8 +1,6 @@
 import argparse
-import os
 import sys
 import logging
-from auth_service.core.config import Config as auth_config
 
 logging.basicConfig(level=logging.INFO)
 
@@ -21,36 +19,110 @@ def run_dev() -> int:
 
 
 def run_prod() -> int:
-    import asyncio
-    from auth_service.fastapi_app import application
+    from auth_service.server import run, server_options
 
-    from hypercorn.config import Config
-    from hypercorn.asyncio import serve
+    run(server_options())
+
+    return 0
+
+
+def run_bench(connections: int, streams: int, duration: float) -> int:
+    from auth_service.server import bench
+
+    results = bench(connections, streams, duration)
+    print(f"{'profile':<20} {'req/s':>10} {'p50 (ms)':>10} {'p99 (ms)':>10}")
+    for name, result in results.items():
+        if "error" in result:
+            print(f"{name:<20} failed: {result['error']}")
+            continue
+        print(
+            f"{name:<20} {result['requests_per_second']:>10.1f} "
+            f"{result['p50_ms']:>10.2f} {result['p99_ms']:>10.2f}"
+        )
+    return 0
+
+
+def run_rebalance_sessions() -> int:
+    import auth_service.crud.user as crud
+    import auth_service.db.model.create_tables
+
+    auth_service.db.model.create_tables.create_all()
+    moved = crud.rebalance_token_sessions()
+    logging.info(f"Rebalanced {moved} token sessions")
+    return 0
 
-    config = Config()
-    config.bind = ["0.0.0.0:443"]
-    config.loglevel = "INFO"
-    config.accesslog = "-"
-    config.errorlog = "-"
-    config.keyfile = auth_config().keyfile
-    config.certfile = auth_config().certfile
 
-    assert os.path.exists(config.keyfile), f"Key file {config.keyfile} does not exist"
-    assert os.path.exists(
-        config.certfile
-    ), f"Cert file {config.certfile} does not exist"
+def run_revoke_user_sessions(email: str) -> int:
+    import auth_service.crud.user as crud
+    from auth_service.api.auth import revoke_user_sessions
+    from auth_service.db.database import SessionLocal, ShardedSession
+
+    db = SessionLocal()
+    shards = ShardedSession()
+    try:
+        user = crud.get_user_by_email(db, email)
+        if not user:
+            logging.error(f"User {email} not found")
+            return 1
+        revoked = revoke_user_sessions(shards, user.id)
+    finally:
+        shards.close()
+        db.close()
+    logging.info(f"Revoked {revoked} sessions of {email}")
+    return 0
+
 
-    asyncio.run(serve(application, config))
+def run_profile_token(ttl: int) -> int:
+    from auth_service.core.profiling import sign_profile_token
 
+    print(sign_profile_token(ttl))
     return 0
 
 
 def main() -> int:
     parser = argparse.ArgumentParser(prog="auth_service", description="Auth service")
     parser.add_argument("-p", "--prod", action="store_true")
+    parser.add_argument(
+        "--rebalance-sessions",
+        action="store_true",
+        help="Move the token sessions to the shard owning their user and exit",
+    )
+    parser.add_argument(
+        "--bench",
+        action="store_true",
+        help="Compare the [server.bench.<name>] configurations and exit",
+    )
+    parser.add_argument("--bench-connections", type=int, default=50)
+    parser.add_argument("--bench-streams", type=int, default=10)
+    parser.add_argument("--bench-duration", type=float, default=10.0)
+    parser.add_argument(
+        "--revoke-user-sessions",
+        metavar="EMAIL",
+        help="Sign the user out of all their sessions and exit",
+    )
+    parser.add_argument(
+        "--profile-token",
+        type=int,
+        metavar="TTL",
+        help="Print a X-Profile-Token header value valid for TTL seconds and exit",
+    )
 
     args = parser.parse_args()
 
+    if args.revoke_user_sessions:
+        return run_revoke_user_sessions(args.revoke_user_sessions)
+
+    if args.profile_token:
+        return run_profile_token(args.profile_token)
+
+    if args.bench:
+        return run_bench(
+            args.bench_connections, args.bench_streams, args.bench_duration
+        )
+
+    if args.rebalance_sessions:
+        return run_rebalance_sessions()
+
     if args.prod:
         return run_prod()
 
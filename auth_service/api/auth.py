@@ -1,43 +1,101 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Request
 from fastapi.security import OAuth2PasswordRequestForm
 from sqlalchemy.orm import Session
-from typing import Annotated
+from typing import Annotated, Any, Callable
 from datetime import datetime, timedelta, timezone
+import asyncio
 import uuid
 
 import auth_service.core.auth as auth_core
+from auth_service.core.audit import AUDIT_LOG
+from auth_service.core.coalescing import SingleFlight
 import auth_service.crud.user as crud
-from auth_service.db.database import get_db
+import auth_service.db.model.user as user_model
+from auth_service.crud.user_cache import CachedUser
+from auth_service.db.database import (
+    get_db,
+    get_shards,
+    ShardedSession,
+    SessionLocal,
+)
 import auth_service.schemas.user as user_schema
 import auth_service.schemas.token as token_schema
 
 router = APIRouter()
 
+# Tabs refreshing the same token at once share a single rotation
+REFRESH_FLIGHT = SingleFlight(auth_core.REFRESH_GRACE_SECONDS)
+EXCHANGE_FLIGHT = SingleFlight(auth_core.REFRESH_GRACE_SECONDS)
+
+
+async def _run_in_thread_with_sessions(
+    func: Callable[[Session, ShardedSession], Any],
+) -> Any:
+    """
+    Run func(db, shards) in a thread, with sessions of its own: a coalesced
+    computation may outlive the request which started it.
+    """
+
+    def run():
+        db = SessionLocal()
+        shards = ShardedSession(db)
+        try:
+            return func(db, shards)
+        finally:
+            shards.close()
+            db.close()
+
+    return await asyncio.to_thread(run)
+
+
+def _revoke_tokens(tokens: list[str]) -> None:
+    for token in tokens:
+        try:
+            auth_core.revoke_token(auth_core.decode_token(token))
+        except Exception:
+            # An expired token cannot be used anyway
+            pass
+
 
 def _get_token_session(
-    db: Session, data: user_schema.UserCreate
+    db: Session, shards: ShardedSession, data: user_schema.UserCreate
 ) -> token_schema.TokenInfoWithCode:
+    # The password hash is always read from the database, never from the cache
     user = crud.get_user_by_email(db, data.email)
     if not user:
         raise HTTPException(status_code=401, detail="Incorrect username or password")
     if not crud.verify_password(data.password, user.hashed_password):
         raise HTTPException(status_code=401, detail="Incorrect username or password")
-    code = str(uuid.uuid4())
+    code = auth_core.create_code(user.id)
     access_token_expires = datetime.now(timezone.utc) + timedelta(
         minutes=auth_core.ACCESS_TOKEN_EXPIRE_MINUTES
     )
     access_token = auth_core.create_token(
-        data={"sub": user.sub, "email": user.email, "exp": access_token_expires}
+        data={
+            "sub": user.sub,
+            "email": user.email,
+            "uid": user.id,
+            "exp": access_token_expires,
+        }
     )
     uuid_refresh_token = str(uuid.uuid4())
     refresh_token_expires = datetime.now(timezone.utc) + timedelta(
         minutes=auth_core.REFRESH_TOKEN_EXPIRE_MINUTES
     )
     refresh_token = auth_core.create_token(
-        data={"uuid": uuid_refresh_token, "exp": refresh_token_expires}
+        data={
+            "uuid": uuid_refresh_token,
+            "uid": user.id,
+            "exp": refresh_token_expires,
+        }
     )
+    evicted_tokens = []
+    if auth_core.MAX_SESSIONS_PER_USER > 0:
+        evicted_tokens = crud.evict_oldest_token_sessions(
+            shards, user.id, auth_core.MAX_SESSIONS_PER_USER - 1
+        )
     crud.create_token_session(
-        db,
+        shards,
         code,
         uuid_refresh_token,
         access_token,
@@ -46,6 +104,7 @@ def _get_token_session(
         access_token_expires,
         refresh_token_expires,
     )
+    _revoke_tokens(evicted_tokens)
     return token_schema.TokenInfoWithCode(
         code=code,
         access_token=access_token,
@@ -57,9 +116,14 @@ def _get_token_session(
 
 
 def _update_token_session(
-    db: Session, uuid_refresh_token: str
+    db: Session,
+    shards: ShardedSession,
+    uuid_refresh_token: str,
+    user_id: int | None = None,
 ) -> token_schema.TokenInfoWithCode:
-    token_session = crud.get_token_session_by_uuid_refresh_token(db, uuid_refresh_token)
+    token_session = crud.get_token_session_by_uuid_refresh_token(
+        shards, uuid_refresh_token, user_id
+    )
     if not token_session:
         raise HTTPException(status_code=401, detail="Invalid refresh token")
     if (
@@ -69,25 +133,37 @@ def _update_token_session(
         < 0
     ):
         raise HTTPException(status_code=401, detail="Refresh token expired")
-    user = crud.get_user_by_id(db, token_session.user_id)
-    if not token_session:
+    user = crud.get_cached_user_by_id(db, token_session.user_id)
+    if not user:
         raise HTTPException(status_code=401, detail="Invalid token session")
-    code = str(uuid.uuid4())
+    code = auth_core.create_code(user.id)
     access_token_expires = datetime.now(timezone.utc) + timedelta(
         minutes=auth_core.ACCESS_TOKEN_EXPIRE_MINUTES
     )
     access_token = auth_core.create_token(
-        data={"sub": user.sub, "email": user.email, "exp": access_token_expires}
+        data={
+            "sub": user.sub,
+            "email": user.email,
+            "uid": user.id,
+            "exp": access_token_expires,
+        }
     )
     new_uuid_refresh_token = str(uuid.uuid4())
     refresh_token_expires = datetime.now(timezone.utc) + timedelta(
         minutes=auth_core.REFRESH_TOKEN_EXPIRE_MINUTES
     )
     refresh_token = auth_core.create_token(
-        data={"uuid": new_uuid_refresh_token, "exp": refresh_token_expires}
+        data={
+            "uuid": new_uuid_refresh_token,
+            "uid": user.id,
+            "exp": refresh_token_expires,
+        }
     )
+    # The access token being replaced must not outlive its session
+    replaced_token = token_session.token
     crud.update_token_session(
-        db,
+        shards,
+        token_session.user_id,
         token_session.id,
         code,
         new_uuid_refresh_token,
@@ -96,6 +172,7 @@ def _update_token_session(
         access_token_expires,
         refresh_token_expires,
     )
+    _revoke_tokens([replaced_token])
     return token_schema.TokenInfoWithCode(
         code=code,
         access_token=access_token,
@@ -106,38 +183,126 @@ def _update_token_session(
     )
 
 
+def _get_current_user(token: str, db: Session) -> CachedUser:
+    token_data = auth_core.verify_token(
+        token, HTTPException(status_code=401, detail="Invalid token")
+    )
+    user = crud.get_cached_user_by_email(db, token_data.email)
+    if not user or user.sub != token_data.sub:
+        raise HTTPException(status_code=401, detail="Invalid token")
+    return user
+
+
+def revoke_user_sessions(shards: ShardedSession, user_id: int) -> int:
+    """
+    Delete all the sessions of a user and revoke their access tokens.
+
+    Returns:
+        int: The number of revoked sessions
+    """
+    tokens = crud.delete_token_sessions_by_user(shards, user_id)
+    _revoke_tokens(tokens)
+    return len(tokens)
+
+
+def _client(request: Request) -> str | None:
+    return request.client.host if request.client else None
+
+
+async def _login(
+    db: Session,
+    shards: ShardedSession,
+    data: user_schema.UserCreate,
+    request: Request,
+) -> token_schema.TokenInfoWithCode:
+    try:
+        # bcrypt would hold the event loop, and the cheap routes with it
+        session = await asyncio.to_thread(_get_token_session, db, shards, data)
+    except HTTPException as e:
+        await AUDIT_LOG.record(
+            "login_failed", email=data.email, client=_client(request), reason=e.detail
+        )
+        raise
+    await AUDIT_LOG.record("login", email=data.email, client=_client(request))
+    return session
+
+
 @router.post("/token")
 async def login_for_access_token(
     form_data: Annotated[OAuth2PasswordRequestForm, Depends()],
+    request: Request,
     db: Session = Depends(get_db),
+    shards: ShardedSession = Depends(get_shards),
 ) -> token_schema.TokenInfo:
-    return _get_token_session(
+    return await _login(
         db,
+        shards,
         user_schema.UserCreate(email=form_data.username, password=form_data.password),
+        request,
     )
 
 
 @router.post("/login")
 async def login(
     data: user_schema.UserCreate,
+    request: Request,
     db: Session = Depends(get_db),
+    shards: ShardedSession = Depends(get_shards),
 ) -> token_schema.LoginCode:
-    session = _get_token_session(db, data)
+    session = await _login(db, shards, data, request)
     return token_schema.LoginCode(code=session.code)
 
 
 @router.post("/logout", status_code=204)
 async def logout(
     token: Annotated[str, Depends(auth_core.OAUTH2_SCHEME)],
-    db: Session = Depends(get_db),
+    request: Request,
+    shards: ShardedSession = Depends(get_shards),
 ) -> None:
-    crud.delete_token_session(db, token)
+    sub = None
+    user_id = None
+    try:
+        payload = auth_core.decode_token(token)
+        sub = payload.get("sub")
+        user_id = payload.get("uid")
+        auth_core.revoke_token(payload)
+    except Exception:
+        # An invalid or expired token cannot be used anyway
+        pass
+    crud.delete_token_session(shards, token, user_id)
+    await AUDIT_LOG.record("logout", sub=sub, client=_client(request))
     return None
 
 
-@router.get("/exchange")
-async def get_token(code: str, db: Session = Depends(get_db)) -> token_schema.TokenInfo:
-    token_session = crud.get_token_session_by_code(db, code)
+@router.get("/sessions")
+async def list_sessions(
+    token: Annotated[str, Depends(auth_core.OAUTH2_SCHEME)],
+    db: Session = Depends(get_db),
+    shards: ShardedSession = Depends(get_shards),
+) -> list[token_schema.TokenSessionInfo]:
+    user = _get_current_user(token, db)
+    return crud.get_token_sessions_by_user(shards, user.id)
+
+
+@router.delete("/sessions")
+async def revoke_sessions(
+    token: Annotated[str, Depends(auth_core.OAUTH2_SCHEME)],
+    request: Request,
+    db: Session = Depends(get_db),
+    shards: ShardedSession = Depends(get_shards),
+) -> token_schema.SessionsRevoked:
+    user = _get_current_user(token, db)
+    revoked = revoke_user_sessions(shards, user.id)
+    await AUDIT_LOG.record(
+        "logout_all", sub=user.sub, revoked=revoked, client=_client(request)
+    )
+    return token_schema.SessionsRevoked(revoked=revoked)
+
+
+def _exchange_code(shards: ShardedSession, code: str) -> token_schema.TokenInfo:
+    token_session = crud.get_token_session_by_code(
+        shards, code, auth_core.code_user_id(code)
+    )
     if not token_session:
         raise HTTPException(status_code=401, detail="Invalid code")
     if (
@@ -156,28 +321,52 @@ async def get_token(code: str, db: Session = Depends(get_db)) -> token_schema.To
     )
 
 
+@router.get("/exchange")
+async def get_token(code: str) -> token_schema.TokenInfo:
+    async def exchange() -> token_schema.TokenInfo:
+        return await _run_in_thread_with_sessions(
+            lambda db, shards: _exchange_code(shards, code)
+        )
+
+    return await EXCHANGE_FLIGHT.do(code, exchange)
+
+
 @router.get("/me")
 async def read_users_me(
     token: Annotated[str, Depends(auth_core.OAUTH2_SCHEME)],
 ) -> user_schema.UserGetToken:
-    return user_schema.UserGetToken(**auth_core.decode_token(token))
+    payload = auth_core.decode_token(token)
+    if auth_core.is_token_revoked(payload):
+        raise HTTPException(status_code=401, detail="Token revoked")
+    return user_schema.UserGetToken(**payload)
+
+
+def _create_user(db: Session, user: user_schema.UserCreate) -> user_model.User | None:
+    if crud.get_user_by_email(db, user.email):
+        return None
+    return crud.create_user(db, user)
 
 
 @router.post("/register")
 async def register_user(
-    user: user_schema.UserCreate, db: Session = Depends(get_db)
+    user: user_schema.UserCreate, request: Request, db: Session = Depends(get_db)
 ) -> user_schema.UserGet:
-    db_user = crud.get_user_by_email(db, user.email)
-    if db_user:
+    db_user = await asyncio.to_thread(_create_user, db, user)
+    if not db_user:
+        await AUDIT_LOG.record(
+            "register_failed", email=user.email, client=_client(request)
+        )
         raise HTTPException(status_code=400, detail="Email already registered")
-    user = crud.create_user(db, user)
-    return user
+    await AUDIT_LOG.record(
+        "register", email=db_user.email, sub=db_user.sub, client=_client(request)
+    )
+    return db_user
 
 
 @router.post("/refresh")
 async def refresh_token(
     refresh_token: Annotated[str, Depends(auth_core.OAUTH2_SCHEME)],
-    db: Session = Depends(get_db),
+    request: Request,
 ) -> token_schema.TokenInfo:
     if not refresh_token:
         raise HTTPException(status_code=401, detail="Invalid refresh token")
@@ -198,4 +387,27 @@ async def refresh_token(
     ):
         raise HTTPException(status_code=401, detail="Refresh token expired")
 
-    return _update_token_session(db, uuid_refresh_token)
+    # Tokens issued before the uid claim are looked up on every shard
+    user_id: int | None = data_refresh_token.get("uid")
+
+    async def update() -> token_schema.TokenInfoWithCode:
+        return await _run_in_thread_with_sessions(
+            lambda db, shards: _update_token_session(
+                db, shards, uuid_refresh_token, user_id
+            )
+        )
+
+    try:
+        session = await REFRESH_FLIGHT.do(uuid_refresh_token, update)
+    except HTTPException as e:
+        await AUDIT_LOG.record(
+            "refresh_failed",
+            session=uuid_refresh_token,
+            client=_client(request),
+            reason=e.detail,
+        )
+        raise
+    await AUDIT_LOG.record(
+        "refresh", session=uuid_refresh_token, client=_client(request)
+    )
+    return session
@@ -0,0 +1,32 @@
+from fastapi import APIRouter, Depends, Header, HTTPException
+from fastapi.responses import PlainTextResponse
+from typing import Annotated
+
+import auth_service.core.profiling as profiling_core
+
+
+def _verify_profile_token(
+    x_profile_token: Annotated[str | None, Header()] = None,
+) -> None:
+    if not x_profile_token or not profiling_core.verify_profile_token(x_profile_token):
+        raise HTTPException(status_code=403, detail="Invalid profiling token")
+
+
+router = APIRouter(
+    prefix="/debug/profiles",
+    tags=["debug"],
+    dependencies=[Depends(_verify_profile_token)],
+)
+
+
+@router.get("")
+async def list_profiles() -> list[dict]:
+    return [profile.summary() for profile in profiling_core.PROFILE_STORE.all()]
+
+
+@router.get("/{profile_id}", response_class=PlainTextResponse)
+async def get_profile(profile_id: int) -> PlainTextResponse:
+    profile = profiling_core.PROFILE_STORE.get(profile_id)
+    if not profile:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    return PlainTextResponse(profile.collapsed())
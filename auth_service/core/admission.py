@@ -0,0 +1,192 @@
+import json
+import time
+
+import auth_service.core.config as config
+
+
+class AdaptiveLimiter:
+    """
+    Concurrency limit adapted from the observed latency (AIMD): the limit grows
+    by one per `limit` requests served under the target latency, and shrinks
+    by `backoff` at most once per target latency when requests are slower.
+    """
+
+    __slots__ = [
+        "name",
+        "priority",
+        "target_latency",
+        "min_limit",
+        "max_limit",
+        "backoff",
+        "limit",
+        "in_flight",
+        "admitted",
+        "shed",
+        "_last_decrease",
+    ]
+
+    def __init__(
+        self,
+        name: str,
+        priority: int = 0,
+        target_latency: float = 0.1,
+        initial_limit: int = 20,
+        min_limit: int = 1,
+        max_limit: int = 1000,
+        backoff: float = 0.9,
+    ):
+        """
+        Parameters:
+            name: str
+            priority: int, 0 is the highest, lower priorities back off first
+            target_latency: float, in seconds
+            initial_limit: int
+            min_limit: int
+            max_limit: int
+            backoff: float, the factor applied to the limit on slow requests
+        """
+        self.name = name
+        self.priority = priority
+        self.target_latency = target_latency
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.backoff = backoff
+        self.limit = float(initial_limit)
+        self.in_flight = 0
+        self.admitted = 0
+        self.shed = 0
+        self._last_decrease = 0.0
+
+    def try_acquire(self) -> bool:
+        if self.in_flight >= int(self.limit):
+            self.shed += 1
+            return False
+        self.in_flight += 1
+        self.admitted += 1
+        return True
+
+    def release(self) -> None:
+        self.in_flight -= 1
+
+    def on_success(self) -> None:
+        self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+
+    def on_overload(self, now: float) -> None:
+        if now - self._last_decrease < self.target_latency:
+            return
+        self._last_decrease = now
+        self.limit = max(self.min_limit, self.limit * self.backoff)
+
+    def stats(self) -> dict:
+        return {
+            "priority": self.priority,
+            "limit": int(self.limit),
+            "in_flight": self.in_flight,
+            "admitted": self.admitted,
+            "shed": self.shed,
+        }
+
+
+class AdmissionControl:
+    """
+    Limiters per lane, each lane being a set of routes ("METHOD /path").
+
+    A request slower than the target of its lane shrinks the limit of its
+    lane and of every lane of lower priority, so that the expensive routes
+    are shed to keep the cheap ones flowing.
+    """
+
+    __slots__ = ["enabled", "retry_after", "lanes", "_routes"]
+
+    def __init__(
+        self, lanes: dict[str, dict], enabled: bool = True, retry_after: int = 1
+    ):
+        """
+        Parameters:
+            lanes: dict[str, dict], the routes and limiter options of each lane
+            enabled: bool
+            retry_after: int, the Retry-After of the shed requests, in seconds
+        """
+        self.enabled = enabled
+        self.retry_after = retry_after
+        self.lanes: dict[str, AdaptiveLimiter] = {}
+        self._routes: dict[tuple[str, str], AdaptiveLimiter] = {}
+        for name, options in lanes.items():
+            options = dict(options)
+            routes = options.pop("routes", [])
+            limiter = AdaptiveLimiter(name, **options)
+            self.lanes[name] = limiter
+            for route in routes:
+                method, _, path = route.partition(" ")
+                self._routes[(method.upper(), path)] = limiter
+
+    @classmethod
+    def from_config(cls) -> "AdmissionControl":
+        """
+        Create the admission control from the [admission] section of the config.
+        """
+        options = dict(config.Config().config_toml.get("admission", {}))
+        return cls(options.pop("lanes", {}), **options)
+
+    def lane(self, method: str, path: str) -> AdaptiveLimiter | None:
+        return self._routes.get((method, path))
+
+    def observe(self, limiter: AdaptiveLimiter, latency: float) -> None:
+        if latency <= limiter.target_latency:
+            limiter.on_success()
+            return
+        now = time.monotonic()
+        for lane in self.lanes.values():
+            if lane.priority >= limiter.priority:
+                lane.on_overload(now)
+
+    def stats(self) -> dict[str, dict]:
+        return {name: limiter.stats() for name, limiter in self.lanes.items()}
+
+
+class AdmissionMiddleware:
+    """
+    ASGI middleware answering 503 at once to the requests over the limit of
+    their lane. Routes outside any lane are not limited.
+    """
+
+    def __init__(self, app, admission: AdmissionControl):
+        self.app = app
+        self.admission = admission
+
+    async def __call__(self, scope, receive, send):
+        limiter = (
+            self.admission.lane(scope["method"], scope["path"])
+            if scope["type"] == "http"
+            else None
+        )
+        if limiter is None:
+            await self.app(scope, receive, send)
+            return
+        if not limiter.try_acquire():
+            await self._reject(send)
+            return
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            limiter.release()
+            self.admission.observe(limiter, time.perf_counter() - start)
+
+    async def _reject(self, send) -> None:
+        body = json.dumps({"detail": "Service overloaded, retry later"}).encode()
+        await send(
+            {
+                "type": "http.response.start",
+                "status": 503,
+                "headers": [
+                    (b"content-type", b"application/json"),
+                    (b"content-length", str(len(body)).encode()),
+                    (b"retry-after", str(self.admission.retry_after).encode()),
+                ],
+            }
+        )
+        await send({"type": "http.response.body", "body": body})
+
+
+ADMISSION_CONTROL = AdmissionControl.from_config()
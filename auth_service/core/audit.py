@@ -0,0 +1,210 @@
+import asyncio
+import collections
+import fcntl
+import json
+import logging
+import os
+from datetime import datetime, timezone
+
+import auth_service.core.config as config
+
+logger = logging.getLogger(__name__)
+
+OVERFLOW_POLICIES = ("drop_newest", "drop_oldest", "block")
+
+
+class AuditLog:
+    """
+    Append-only log of authentication events.
+
+    Events are pushed into a bounded in-memory buffer and written in batches
+    to a rotating JSONL file by a background task, so that requests never
+    wait on the disk.
+    """
+
+    __slots__ = [
+        "path",
+        "enabled",
+        "capacity",
+        "batch_size",
+        "flush_interval",
+        "overflow",
+        "block_timeout",
+        "max_bytes",
+        "backup_count",
+        "written",
+        "dropped",
+        "_buffer",
+        "_not_empty",
+        "_not_full",
+        "_writer",
+        "_closing",
+    ]
+
+    def __init__(
+        self,
+        path: str,
+        enabled: bool = True,
+        capacity: int = 10000,
+        batch_size: int = 500,
+        flush_interval: float = 1.0,
+        overflow: str = "drop_newest",
+        block_timeout: float = 0.1,
+        max_bytes: int = 100 * 1024 * 1024,
+        backup_count: int = 10,
+    ):
+        """
+        Parameters:
+            path: str, the JSONL file
+            enabled: bool
+            capacity: int, the maximum number of buffered events
+            batch_size: int, the number of events triggering a write
+            flush_interval: float, the maximum delay before a write, in seconds
+            overflow: str, what to do when the buffer is full:
+                "drop_newest", "drop_oldest" or "block"
+            block_timeout: float, how long "block" waits before dropping
+            max_bytes: int, the size triggering a rotation of the file
+            backup_count: int, the number of rotated files kept
+        """
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError(f"Unknown audit overflow policy: {overflow}")
+        self.path = path
+        self.enabled = enabled
+        self.capacity = capacity
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.overflow = overflow
+        self.block_timeout = block_timeout
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.written = 0
+        self.dropped = 0
+        self._buffer: collections.deque[dict] = collections.deque()
+        # Created by start(), in the event loop of the application
+        self._not_empty: asyncio.Event | None = None
+        self._not_full: asyncio.Event | None = None
+        self._writer: asyncio.Task | None = None
+        self._closing = False
+
+    @classmethod
+    def from_config(cls) -> "AuditLog":
+        """
+        Create the audit log from the [audit] section of the config file.
+        """
+        options = dict(config.Config().config_toml.get("audit", {}))
+        options.setdefault(
+            "path",
+            os.path.join(os.path.dirname(config.Config().database_path), "audit.jsonl"),
+        )
+        return cls(**options)
+
+    def stats(self) -> dict:
+        return {
+            "buffered": len(self._buffer),
+            "written": self.written,
+            "dropped": self.dropped,
+        }
+
+    async def record(self, event: str, **fields) -> None:
+        """
+        Add an event to the buffer.
+
+        Parameters:
+            event: str, the kind of event (login, login_failed, ...)
+            fields: the details of the event
+        """
+        if not self.enabled:
+            return
+        if (
+            len(self._buffer) >= self.capacity
+            and self.overflow == "block"
+            and self._not_full is not None
+        ):
+            self._not_full.clear()
+            try:
+                await asyncio.wait_for(self._not_full.wait(), self.block_timeout)
+            except asyncio.TimeoutError:
+                pass
+        if len(self._buffer) >= self.capacity:
+            self.dropped += 1
+            if self.overflow != "drop_oldest":
+                return
+            self._buffer.popleft()
+        self._buffer.append(
+            {"time": datetime.now(timezone.utc).isoformat(), "event": event, **fields}
+        )
+        if len(self._buffer) >= self.batch_size and self._not_empty is not None:
+            self._not_empty.set()
+
+    def start(self) -> None:
+        if self.enabled and self._writer is None:
+            self._closing = False
+            self._not_empty = asyncio.Event()
+            self._not_full = asyncio.Event()
+            self._not_full.set()
+            self._writer = asyncio.create_task(self._run())
+
+    async def close(self) -> None:
+        """
+        Stop the background writer and write the remaining events.
+        """
+        self._closing = True
+        if self._writer is not None:
+            self._not_empty.set()
+            await self._writer
+            self._writer = None
+        await self._flush()
+        self._not_empty = None
+        self._not_full = None
+        if self.dropped:
+            logger.warning(f"{self.dropped} audit events dropped")
+
+    async def _run(self) -> None:
+        while not self._closing:
+            try:
+                try:
+                    await asyncio.wait_for(self._not_empty.wait(), self.flush_interval)
+                except asyncio.TimeoutError:
+                    pass
+                self._not_empty.clear()
+                await self._flush()
+            except Exception:
+                # Keep the writer alive, the events stay bounded by the buffer
+                logger.exception("Error writing the audit log")
+                await asyncio.sleep(self.flush_interval)
+
+    async def _flush(self) -> None:
+        while self._buffer:
+            batch = [
+                self._buffer.popleft()
+                for _ in range(min(self.batch_size, len(self._buffer)))
+            ]
+            if self._not_full is not None:
+                self._not_full.set()
+            data = "".join(json.dumps(event, default=str) + "\n" for event in batch)
+            await asyncio.to_thread(self._write, data.encode("utf-8"))
+            self.written += len(batch)
+
+    def _write(self, data: bytes) -> None:
+        # The lock keeps the workers from writing during a rotation
+        with open(f"{self.path}.lock", "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            if (
+                os.path.exists(self.path)
+                and os.path.getsize(self.path) + len(data) > self.max_bytes
+            ):
+                self._rotate()
+            with open(self.path, "ab") as file:
+                file.write(data)
+
+    def _rotate(self) -> None:
+        for index in range(self.backup_count - 1, 0, -1):
+            if os.path.exists(f"{self.path}.{index}"):
+                os.replace(f"{self.path}.{index}", f"{self.path}.{index + 1}")
+        if self.backup_count > 0:
+            os.replace(self.path, f"{self.path}.1")
+        else:
+            os.remove(self.path)
+
+
+AUDIT_LOG = AuditLog.from_config()
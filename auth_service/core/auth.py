@@ -1,22 +1,38 @@
 import jwt
+import uuid
 from datetime import timezone, datetime
 from fastapi.security import OAuth2PasswordBearer
 from fnmatch import fnmatch
 
 import auth_service.schemas.token as token_schema
 import auth_service.core.config as config
+from auth_service.core.revocation import RevocationList
 
 SECRET_KEY = config.Config().secret_key
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = config.Config().access_token_expire_minutes
 REFRESH_TOKEN_EXPIRE_MINUTES = config.Config().refresh_token_expire_minutes
+# Oldest sessions of a user are evicted beyond this number, 0 for no limit
+MAX_SESSIONS_PER_USER = (
+    config.Config().config_toml.get("auth", {}).get("max_sessions_per_user", 0)
+)
+
+# Duplicate refresh and exchange calls get the same answer within this delay
+REFRESH_GRACE_SECONDS = (
+    config.Config().config_toml.get("auth", {}).get("refresh_grace_seconds", 10)
+)
 
 OAUTH2_SCHEME = OAuth2PasswordBearer(tokenUrl="token")
 
+REVOCATION_LIST = RevocationList(
+    config.Config().revocation_list_path, ACCESS_TOKEN_EXPIRE_MINUTES * 60
+)
+
 
 def create_token(data: dict) -> str:
     """
     Create an token for the given data.
+    A unique token ID (`jti`) is added so that the token can be revoked.
 
     Parameters:
         data: dict
@@ -25,10 +41,33 @@ def create_token(data: dict) -> str:
         str: The encoded JWT token
     """
     to_encode = data.copy()
+    to_encode.setdefault("jti", str(uuid.uuid4()))
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
 
+def create_code(user_id: int) -> str:
+    """
+    Create a login code, prefixed with the user id so that the session shard
+    holding it is known.
+
+    Parameters:
+        user_id: int
+
+    Returns:
+        str: The code
+    """
+    return f"{user_id}.{uuid.uuid4()}"
+
+
+def code_user_id(code: str) -> int | None:
+    """
+    Return the user id prefixing the given code, None for a code without one.
+    """
+    prefix, separator, _ = code.partition(".")
+    return int(prefix) if separator and prefix.isdigit() else None
+
+
 def decode_token(token: str) -> dict:
     """
     Decode the given token and return the payload.
@@ -49,16 +88,42 @@ def verify_token(token: str, credentials_exception) -> token_schema.TokenData:
     """
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        if is_token_revoked(payload):
+            raise credentials_exception
         sub: str = payload.get("sub")
         email: str = payload.get("email")
         if sub is None or email is None:
             raise credentials_exception
         token_data = token_schema.TokenData(sub=sub, email=email)
         return token_data
-    except jwt.JWTError:
+    except jwt.PyJWTError:
         raise credentials_exception
 
 
+def revoke_token(payload: dict) -> None:
+    """
+    Revoke the token with the given payload until its expiry.
+
+    Parameters:
+        payload: dict
+    """
+    if payload.get("jti") and payload.get("exp"):
+        REVOCATION_LIST.revoke(payload["jti"], payload["exp"])
+
+
+def is_token_revoked(payload: dict) -> bool:
+    """
+    Check if the token with the given payload has been revoked.
+
+    Parameters:
+        payload: dict
+
+    Returns:
+        bool: True if the token has been revoked, False otherwise
+    """
+    return REVOCATION_LIST.is_revoked(payload.get("jti"))
+
+
 def is_allowed_redirect_url(redirect_url: str, allowed_patterns: tuple) -> bool:
     """
     Check if the given redirect URL is allowed.
@@ -106,5 +171,5 @@ def decode_token(token: str) -> dict:
     """
     try:
         return jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-    except jwt.JWTError:
+    except jwt.PyJWTError:
         raise Exception("Invalid token")
@@ -0,0 +1,70 @@
+import asyncio
+import collections
+import functools
+import time
+from typing import Any, Awaitable, Callable, Hashable
+
+
+class SingleFlight:
+    """
+    Coalesce concurrent identical calls: the calls made with the same key while
+    a first one is running wait for it and share its result.
+
+    The shared computation runs in its own task, so a caller going away (a
+    client disconnecting) does not cancel it for the others. The result is
+    then replayed for `grace` seconds to the late duplicates. Exceptions are
+    shared with the waiting calls but never replayed.
+    """
+
+    __slots__ = ["grace", "max_entries", "_in_flight", "_results"]
+
+    def __init__(self, grace: float, max_entries: int = 10000):
+        """
+        Parameters:
+            grace: float, how long a result is replayed, in seconds
+            max_entries: int, the maximum number of results kept
+        """
+        self.grace = grace
+        self.max_entries = max_entries
+        self._in_flight: dict[Hashable, asyncio.Task] = {}
+        self._results: collections.OrderedDict[Hashable, tuple[float, Any]] = (
+            collections.OrderedDict()
+        )
+
+    async def do(self, key: Hashable, func: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        Return the result of `func`, shared with the other calls with this key.
+        `func` must not depend on the resources of the calling request, which
+        may be released before the computation ends.
+
+        Parameters:
+            key: Hashable
+            func: Callable[[], Awaitable[Any]]
+        """
+        self._prune(time.monotonic())
+        if key in self._results:
+            return self._results[key][1]
+        task = self._in_flight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(func())
+            self._in_flight[key] = task
+            task.add_done_callback(functools.partial(self._done, key))
+        return await asyncio.shield(task)
+
+    def _done(self, key: Hashable, task: asyncio.Task) -> None:
+        del self._in_flight[key]
+        # Retrieving the exception also marks it as handled
+        if task.cancelled() or task.exception() is not None:
+            return
+        if self.grace > 0:
+            self._results[key] = (time.monotonic() + self.grace, task.result())
+            if len(self._results) > self.max_entries:
+                self._results.popitem(last=False)
+
+    def _prune(self, now: float) -> None:
+        # Results are stored in expiry order, the grace being the same for all
+        while self._results:
+            key, (expires_at, _) = next(iter(self._results.items()))
+            if expires_at > now:
+                break
+            del self._results[key]
@@ -34,6 +34,8 @@ class Config:
         "access_token_expire_minutes",
         "refresh_token_expire_minutes",
         "database_path",
+        "session_shards",
+        "revocation_list_path",
         "keyfile",
         "certfile",
         "config_toml",
@@ -57,6 +59,13 @@ class Config:
         self.database_path = os.getenv("DATABASE_PATH", "data/auth.db")
         if not os.path.exists(os.path.dirname(self.database_path)):
             os.makedirs(os.path.dirname(self.database_path))
+        self.session_shards = int(os.getenv("SESSION_SHARDS", 1))
+        if self.session_shards < 1:
+            raise ValueError("SESSION_SHARDS must be at least 1")
+        self.revocation_list_path = os.getenv(
+            "REVOCATION_LIST_PATH",
+            os.path.join(os.path.dirname(self.database_path), "revoked_tokens.log"),
+        )
 
         self.access_token_expire_minutes = int(
             os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES", 30)
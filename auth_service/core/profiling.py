@@ -0,0 +1,211 @@
+import collections
+import hashlib
+import hmac
+import itertools
+import os
+import random
+import sys
+import threading
+import time
+from datetime import datetime, timezone
+
+import auth_service.core.config as config
+
+PROFILE_HEADER = b"x-profile-token"
+
+PROFILING_CONFIG = config.Config().config_toml.get("profiling", {})
+
+_PACKAGE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__))) + os.sep
+
+
+def sign_profile_token(ttl: int = 300) -> str:
+    """
+    Create a token enabling the profiling of the requests carrying it.
+
+    Parameters:
+        ttl: int, the validity of the token in seconds
+
+    Returns:
+        str: The token, to send in the X-Profile-Token header
+    """
+    expires = int(time.time()) + ttl
+    signature = hmac.new(
+        config.Config().secret_key.encode("utf-8"),
+        f"profile:{expires}".encode("utf-8"),
+        hashlib.sha256,
+    ).hexdigest()
+    return f"{expires}.{signature}"
+
+
+def verify_profile_token(token: str) -> bool:
+    """
+    Check the signature and the expiry of the given profiling token.
+    """
+    expires, _, signature = token.partition(".")
+    if not expires.isdigit() or int(expires) < time.time():
+        return False
+    expected = hmac.new(
+        config.Config().secret_key.encode("utf-8"),
+        f"profile:{expires}".encode("utf-8"),
+        hashlib.sha256,
+    ).hexdigest()
+    return hmac.compare_digest(signature, expected)
+
+
+class Profile:
+    """
+    Stack samples taken during one request.
+    """
+
+    __slots__ = ["id", "method", "path", "started_at", "duration", "stacks"]
+
+    def __init__(self, id: int, method: str, path: str):
+        self.id = id
+        self.method = method
+        self.path = path
+        self.started_at = datetime.now(timezone.utc)
+        self.duration = 0.0
+        self.stacks: collections.Counter[str] = collections.Counter()
+
+    def summary(self) -> dict:
+        return {
+            "id": self.id,
+            "method": self.method,
+            "path": self.path,
+            "started_at": self.started_at,
+            "duration_ms": self.duration * 1000,
+            "samples": sum(self.stacks.values()),
+        }
+
+    def collapsed(self) -> str:
+        """
+        Return the samples in the collapsed stack format of flamegraph.pl.
+        """
+        return "".join(f"{stack} {count}\n" for stack, count in self.stacks.items())
+
+
+class ProfileStore:
+    """
+    The last `max_profiles` profiles, oldest evicted first.
+    """
+
+    __slots__ = ["max_profiles", "_profiles", "_ids"]
+
+    def __init__(self, max_profiles: int):
+        self.max_profiles = max_profiles
+        self._profiles: collections.OrderedDict[int, Profile] = (
+            collections.OrderedDict()
+        )
+        self._ids = itertools.count(1)
+
+    def new(self, method: str, path: str) -> Profile:
+        return Profile(next(self._ids), method, path)
+
+    def add(self, profile: Profile) -> None:
+        self._profiles[profile.id] = profile
+        while len(self._profiles) > self.max_profiles:
+            self._profiles.popitem(last=False)
+
+    def get(self, id: int) -> Profile | None:
+        return self._profiles.get(id)
+
+    def all(self) -> list[Profile]:
+        return list(reversed(self._profiles.values()))
+
+
+def _collapse(frame) -> str:
+    stack = []
+    while frame is not None:
+        code = frame.f_code
+        stack.append(f"{code.co_name} ({code.co_filename}:{code.co_firstlineno})")
+        frame = frame.f_back
+    return ";".join(reversed(stack))
+
+
+class StackSampler(threading.Thread):
+    """
+    Thread sampling every `interval` seconds the stack of another thread, and
+    of the threads running code of the service meanwhile, such as the workers
+    of asyncio.to_thread. Each stack starts with the name of its thread.
+    """
+
+    def __init__(self, thread_id: int, interval: float, profile: Profile):
+        super().__init__(daemon=True)
+        self.thread_id = thread_id
+        self.interval = interval
+        self.profile = profile
+        self._stopped = threading.Event()
+
+    def run(self) -> None:
+        while not self._stopped.wait(self.interval):
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == self.ident:
+                    continue
+                stack = _collapse(frame)
+                # Idle workers only wait on their queue
+                if thread_id != self.thread_id and _PACKAGE_DIR not in stack:
+                    continue
+                self.profile.stacks[f"{names.get(thread_id, thread_id)};{stack}"] += 1
+
+    def stop(self) -> None:
+        self._stopped.set()
+        self.join()
+
+
+class ProfilingMiddleware:
+    """
+    ASGI middleware profiling the requests with a valid X-Profile-Token header
+    and a `sample_rate` fraction of the others.
+
+    The stacks of the event loop thread and of the threads running code of
+    the service are sampled while the request runs, so a profile also shows
+    the requests handled concurrently. Only one request is profiled at a time.
+    """
+
+    def __init__(
+        self,
+        app,
+        store: ProfileStore,
+        sample_rate: float = 0.0,
+        interval: float = 0.001,
+    ):
+        self.app = app
+        self.store = store
+        self.sample_rate = sample_rate
+        self.interval = interval
+        self._lock = threading.Lock()
+
+    def _should_profile(self, scope) -> bool:
+        # Do not profile the download of the profiles
+        if scope["path"].startswith("/debug/"):
+            return False
+        if self.sample_rate and random.random() < self.sample_rate:
+            return True
+        for name, value in scope["headers"]:
+            if name == PROFILE_HEADER:
+                return verify_profile_token(value.decode("latin-1"))
+        return False
+
+    async def __call__(self, scope, receive, send):
+        if (
+            scope["type"] != "http"
+            or not self._should_profile(scope)
+            or not self._lock.acquire(blocking=False)
+        ):
+            await self.app(scope, receive, send)
+            return
+        profile = self.store.new(scope["method"], scope["path"])
+        sampler = StackSampler(threading.get_ident(), self.interval, profile)
+        start = time.perf_counter()
+        sampler.start()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            sampler.stop()
+            profile.duration = time.perf_counter() - start
+            self.store.add(profile)
+            self._lock.release()
+
+
+PROFILE_STORE = ProfileStore(PROFILING_CONFIG.get("max_profiles", 50))
@@ -0,0 +1,146 @@
+import fcntl
+import heapq
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class RevocationList:
+    """
+    In-memory set of revoked token IDs (`jti`), shared between the workers of
+    a host through an append-only file.
+
+    Each entry is kept until the expiry of its token, after which the token
+    is rejected by its `exp` claim anyway.
+    """
+
+    __slots__ = [
+        "path",
+        "max_lifetime",
+        "sync_interval",
+        "_revoked",
+        "_expiries",
+        "_offset",
+        "_inode",
+        "_file_entries",
+        "_next_sync",
+        "_lock",
+    ]
+
+    def __init__(self, path: str, max_lifetime: int, sync_interval: float = 1.0):
+        """
+        Parameters:
+            path: str, the file shared by the workers
+            max_lifetime: int, the access token lifetime in seconds
+            sync_interval: float, the minimum delay between two file reads
+        """
+        self.path = path
+        self.max_lifetime = max_lifetime
+        self.sync_interval = sync_interval
+        self._revoked: dict[str, int] = {}
+        self._expiries: list[tuple[int, str]] = []
+        self._offset = 0
+        self._inode = None
+        self._file_entries = 0
+        self._next_sync = 0.0
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._revoked)
+
+    def revoke(self, jti: str, exp: int) -> None:
+        """
+        Revoke the token with the given ID until its expiry.
+
+        Parameters:
+            jti: str
+            exp: int, the expiry of the token as a timestamp
+        """
+        now = int(time.time())
+        exp = min(int(exp), now + self.max_lifetime)
+        if exp <= now:
+            return
+        with self._lock:
+            self._add(jti, exp)
+        with open(f"{self.path}.lock", "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_SH)
+            with open(self.path, "a") as file:
+                file.write(f"{jti} {exp}\n")
+
+    def is_revoked(self, jti: str | None) -> bool:
+        """
+        Check if the token with the given ID has been revoked.
+        """
+        if time.monotonic() >= self._next_sync:
+            self.sync()
+        return jti is not None and jti in self._revoked
+
+    def sync(self) -> None:
+        """
+        Prune the expired entries and load the ones revoked by other workers.
+        """
+        with self._lock:
+            self._next_sync = time.monotonic() + self.sync_interval
+            self._prune(int(time.time()))
+            try:
+                self._read()
+            except OSError as e:
+                logger.error(f"Error reading the revocation list: {e}")
+                return
+            if self._file_entries > 2 * len(self._revoked) + 1024:
+                self._compact()
+
+    def _add(self, jti: str, exp: int) -> None:
+        if self._revoked.get(jti, 0) >= exp:
+            return
+        self._revoked[jti] = exp
+        heapq.heappush(self._expiries, (exp, jti))
+
+    def _prune(self, now: int) -> None:
+        while self._expiries and self._expiries[0][0] <= now:
+            exp, jti = heapq.heappop(self._expiries)
+            if self._revoked.get(jti) == exp:
+                del self._revoked[jti]
+
+    def _read(self) -> None:
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, "rb") as file:
+            stat = os.fstat(file.fileno())
+            # The file has been compacted by another worker
+            if stat.st_ino != self._inode or stat.st_size < self._offset:
+                self._inode = stat.st_ino
+                self._offset = 0
+                self._file_entries = 0
+            file.seek(self._offset)
+            data = file.read()
+        # Leave a partially written last line for the next read
+        complete = data.rfind(b"\n") + 1
+        self._offset += complete
+        now = int(time.time())
+        for line in data[:complete].decode("utf-8").splitlines():
+            try:
+                jti, exp = line.split()
+                exp = int(exp)
+            except ValueError:
+                continue
+            self._file_entries += 1
+            if exp > now:
+                self._add(jti, exp)
+
+    def _compact(self) -> None:
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(f"{self.path}.lock", "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            # Entries appended since the last read must survive the compaction
+            self._read()
+            with open(tmp_path, "w") as file:
+                for jti, exp in self._revoked.items():
+                    file.write(f"{jti} {exp}\n")
+            os.replace(tmp_path, self.path)
+            self._inode = os.stat(self.path).st_ino
+            self._offset = os.path.getsize(self.path)
+            self._file_entries = len(self._revoked)
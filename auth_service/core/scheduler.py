@@ -0,0 +1,133 @@
+import asyncio
+import fcntl
+import logging
+import os
+import random
+from typing import Callable
+
+logger = logging.getLogger(__name__)
+
+
+class LeaderLock:
+    """
+    Non-blocking file lock electing a single leader among the workers of a host.
+
+    The lock is released by the OS when the leader process dies, so another
+    worker takes over on its next attempt.
+    """
+
+    __slots__ = ["path", "_file"]
+
+    def __init__(self, path: str):
+        self.path = path
+        self._file = None
+
+    @property
+    def is_leader(self) -> bool:
+        return self._file is not None
+
+    def acquire(self) -> bool:
+        """
+        Try to become the leader.
+
+        Returns:
+            bool: True if this process holds the lock, False otherwise
+        """
+        if self._file is not None:
+            return True
+        file = open(self.path, "a")
+        try:
+            fcntl.flock(file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            file.close()
+            return False
+        self._file = file
+        logger.info(f"Process {os.getpid()} elected leader for periodic tasks")
+        return True
+
+    def release(self) -> None:
+        if self._file is not None:
+            fcntl.flock(self._file, fcntl.LOCK_UN)
+            self._file.close()
+            self._file = None
+
+
+class PeriodicTask:
+    """
+    A blocking function run in a thread every `interval` seconds.
+    """
+
+    __slots__ = ["name", "func", "interval", "jitter"]
+
+    def __init__(
+        self, name: str, func: Callable[[], None], interval: float, jitter: float
+    ):
+        self.name = name
+        self.func = func
+        self.interval = interval
+        self.jitter = jitter
+
+    def next_delay(self) -> float:
+        return self.interval * (1 + random.uniform(-self.jitter, self.jitter))
+
+
+class Scheduler:
+    """
+    Periodic task runner living in the event loop of the application.
+
+    A run never overlaps the previous run of the same task, and tasks only
+    run in the worker holding the leader lock.
+    """
+
+    __slots__ = ["leader_lock", "_tasks", "_running", "_jobs"]
+
+    def __init__(self, lock_path: str):
+        self.leader_lock = LeaderLock(lock_path)
+        self._tasks: list[PeriodicTask] = []
+        self._running: list[asyncio.Task] = []
+        self._jobs: set[asyncio.Future] = set()
+
+    def add_job(
+        self,
+        func: Callable[[], None],
+        interval: float,
+        jitter: float = 0.1,
+        name: str | None = None,
+    ) -> None:
+        """
+        Run the given function every `interval` seconds, give or take
+        `jitter` times the interval.
+
+        Parameters:
+            func: Callable[[], None], a blocking function without arguments
+            interval: float, in seconds
+            jitter: float, fraction of the interval
+            name: str | None
+        """
+        self._tasks.append(PeriodicTask(name or func.__name__, func, interval, jitter))
+
+    def start(self) -> None:
+        for task in self._tasks:
+            self._running.append(asyncio.create_task(self._run(task)))
+
+    async def shutdown(self) -> None:
+        for running in self._running:
+            running.cancel()
+        await asyncio.gather(*self._running, return_exceptions=True)
+        self._running.clear()
+        # A thread cannot be cancelled: keep the lock until its job has returned
+        await asyncio.gather(*self._jobs, return_exceptions=True)
+        self.leader_lock.release()
+
+    async def _run(self, task: PeriodicTask) -> None:
+        while True:
+            await asyncio.sleep(task.next_delay())
+            if not self.leader_lock.acquire():
+                continue
+            job = asyncio.ensure_future(asyncio.to_thread(task.func))
+            self._jobs.add(job)
+            job.add_done_callback(self._jobs.discard)
+            try:
+                await asyncio.shield(job)
+            except Exception as e:
+                logger.error(f"Error running periodic task {task.name}: {e}")
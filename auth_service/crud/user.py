@@ -2,10 +2,16 @@ from sqlalchemy.orm import Session
 import bcrypt
 import uuid
 from datetime import datetime, timezone
+from concurrent.futures import ThreadPoolExecutor
+import glob
 import logging
 
+from sqlalchemy import create_engine, inspect
+
+import auth_service.db.database as database
 import auth_service.db.model.user as user_model
 import auth_service.schemas.user as user_schema
+from auth_service.crud.user_cache import USER_CACHE, CachedUser
 
 logger = logging.getLogger("crud.user")
 
@@ -24,6 +30,24 @@ def get_user_by_id(db: Session, user_id: int) -> user_model.User | None:
     return db.query(user_model.User).filter(user_model.User.id == user_id).one_or_none()
 
 
+def get_cached_user_by_email(db: Session, email: str) -> CachedUser | None:
+    user = USER_CACHE.get_by_email(email)
+    if user is None:
+        db_user = get_user_by_email(db, email)
+        if db_user is not None:
+            user = USER_CACHE.put(db_user)
+    return user
+
+
+def get_cached_user_by_id(db: Session, user_id: int) -> CachedUser | None:
+    user = USER_CACHE.get_by_id(user_id)
+    if user is None:
+        db_user = get_user_by_id(db, user_id)
+        if db_user is not None:
+            user = USER_CACHE.put(db_user)
+    return user
+
+
 def create_user(db: Session, user: user_schema.UserCreate) -> user_model.User:
     hashed_password = bcrypt.hashpw(user.password.encode("utf-8"), bcrypt.gensalt())
     hashed_password = hashed_password.decode("utf-8")
@@ -33,6 +57,7 @@ def create_user(db: Session, user: user_schema.UserCreate) -> user_model.User:
     db.add(db_user)
     db.commit()
     db.refresh(db_user)
+    USER_CACHE.invalidate(db_user.id, db_user.email)
     return db_user
 
 
@@ -47,24 +72,30 @@ def verify_password(plain_password: str, hashed_password: bytes | str) -> bool:
     )
 
 
-def get_token_session_by_code(db: Session, code: str) -> user_model.TokenSession | None:
+def get_token_session_by_code(
+    shards: database.ShardedSession, code: str, user_id: int | None = None
+) -> user_model.TokenSession | None:
     try:
-        return (
-            db.query(user_model.TokenSession)
-            .filter(user_model.TokenSession.code == code)
-            .filter(
-                user_model.TokenSession.access_token_expires_at
-                > datetime.now(timezone.utc)
+        for db in shards.route(user_id):
+            token_session = (
+                db.query(user_model.TokenSession)
+                .filter(user_model.TokenSession.code == code)
+                .filter(
+                    user_model.TokenSession.access_token_expires_at
+                    > datetime.now(timezone.utc)
+                )
+                .first()
             )
-            .first()
-        )
+            if token_session:
+                return token_session
+        return None
     except Exception as e:
         logger.error(f"Error getting token session by code: {e}")
         return None
 
 
 def create_token_session(
-    db: Session,
+    shards: database.ShardedSession,
     code: str,
     uuid_refresh_token: str,
     token: str,
@@ -73,6 +104,7 @@ def create_token_session(
     access_token_expires_at: datetime,
     refresh_token_expires_at: datetime,
 ) -> user_model.TokenSession:
+    db = shards.for_user(user_id)
     db_token_session = user_model.TokenSession(
         code=code,
         uuid_refresh_token=uuid_refresh_token,
@@ -90,7 +122,8 @@ def create_token_session(
 
 
 def update_token_session(
-    db: Session,
+    shards: database.ShardedSession,
+    user_id: int,
     id_token_session: int,
     code: str,
     uuid_refresh_token: str,
@@ -99,6 +132,7 @@ def update_token_session(
     access_token_expires_at: datetime,
     refresh_token_expires_at: datetime,
 ) -> user_model.TokenSession:
+    db = shards.for_user(user_id)
     db_token_session = get_token_session_by_id(db, id_token_session)
     if not db_token_session:
         raise Exception("Token session not found")
@@ -124,25 +158,221 @@ def get_token_session_by_id(
 
 
 def get_token_session_by_uuid_refresh_token(
-    db: Session, uuid_refresh_token: str
+    shards: database.ShardedSession,
+    uuid_refresh_token: str,
+    user_id: int | None = None,
 ) -> user_model.TokenSession | None:
+    for db in shards.route(user_id):
+        token_session = (
+            db.query(user_model.TokenSession)
+            .filter(user_model.TokenSession.uuid_refresh_token == uuid_refresh_token)
+            .one_or_none()
+        )
+        if token_session:
+            return token_session
+    return None
+
+
+def get_token_sessions_by_user(
+    shards: database.ShardedSession, user_id: int
+) -> list[user_model.TokenSession]:
+    """
+    Return the active token sessions of a user, oldest first.
+    """
     return (
-        db.query(user_model.TokenSession)
-        .filter(user_model.TokenSession.uuid_refresh_token == uuid_refresh_token)
-        .one_or_none()
+        shards.for_user(user_id)
+        .query(user_model.TokenSession)
+        .filter(user_model.TokenSession.user_id == user_id)
+        .filter(
+            user_model.TokenSession.refresh_token_expires_at
+            > datetime.now(timezone.utc)
+        )
+        .order_by(user_model.TokenSession.created_at)
+        .all()
     )
 
 
-def delete_token_session_expired(db: Session) -> None:
+def delete_token_sessions_by_user(
+    shards: database.ShardedSession, user_id: int
+) -> list[str]:
+    """
+    Delete all the token sessions of a user.
+
+    Returns:
+        list[str]: The access tokens of the deleted sessions
+    """
+    db = shards.for_user(user_id)
+    tokens = [
+        token
+        for (token,) in db.query(user_model.TokenSession.token).filter(
+            user_model.TokenSession.user_id == user_id
+        )
+    ]
     db.query(user_model.TokenSession).filter(
-        user_model.TokenSession.refresh_token_expires_at
-        < datetime.now(timezone.utc)
+        user_model.TokenSession.user_id == user_id
     ).delete()
     db.commit()
+    return tokens
+
 
+def evict_oldest_token_sessions(
+    shards: database.ShardedSession, user_id: int, keep: int
+) -> list[str]:
+    """
+    Delete the sessions of a user but the `keep` newest ones.
+    The deletion is committed with the next commit on the shard of the user,
+    so that it happens in the same transaction as the new session.
 
-def delete_token_session(db: Session, token: str) -> None:
+    Returns:
+        list[str]: The access tokens of the evicted sessions
+    """
+    db = shards.for_user(user_id)
+    evicted = (
+        db.query(user_model.TokenSession.id, user_model.TokenSession.token)
+        .filter(user_model.TokenSession.user_id == user_id)
+        .order_by(user_model.TokenSession.created_at.desc())
+        .offset(keep)
+        .all()
+    )
+    if evicted:
+        db.query(user_model.TokenSession).filter(
+            user_model.TokenSession.id.in_([id_ for id_, _ in evicted])
+        ).delete(synchronize_session=False)
+    return [token for _, token in evicted]
+
+
+def delete_token_session_expired(db: Session) -> None:
     db.query(user_model.TokenSession).filter(
-        user_model.TokenSession.token == token
+        user_model.TokenSession.refresh_token_expires_at
+        < datetime.now(timezone.utc)
     ).delete()
     db.commit()
+
+
+def _delete_token_session_expired_in_shard(index: int) -> None:
+    db = database.ShardSessionLocal[index]()
+    try:
+        delete_token_session_expired(db)
+    finally:
+        db.close()
+
+
+def delete_token_session_expired_in_shards() -> None:
+    """
+    Delete the expired token sessions of every shard, one thread per shard.
+    """
+    with ThreadPoolExecutor(max_workers=database.SESSION_SHARD_COUNT) as executor:
+        list(
+            executor.map(
+                _delete_token_session_expired_in_shard,
+                range(database.SESSION_SHARD_COUNT),
+            )
+        )
+
+
+def delete_token_session(
+    shards: database.ShardedSession, token: str, user_id: int | None = None
+) -> None:
+    # Find the owning shard with reads, to write-lock that shard only
+    for db in shards.route(user_id):
+        id_token_session = (
+            db.query(user_model.TokenSession.id)
+            .filter(user_model.TokenSession.token == token)
+            .scalar()
+        )
+        if id_token_session is not None:
+            db.query(user_model.TokenSession).filter(
+                user_model.TokenSession.id == id_token_session
+            ).delete()
+            db.commit()
+            return
+
+
+def _rebalance_source_engines() -> list:
+    if database.SESSION_SHARD_COUNT == 1:
+        # The only shard is the main database, every shard file is a leftover
+        engines = []
+        current_paths = set()
+    else:
+        engines = [database.engine]
+        current_paths = {
+            database.shard_database_path(i) for i in range(database.SESSION_SHARD_COUNT)
+        }
+    for path in sorted(glob.glob(database.shard_database_path("*"))):
+        if path not in current_paths:
+            engines.append(
+                create_engine(
+                    f"sqlite:///{path}", connect_args={"check_same_thread": False}
+                )
+            )
+    return engines + database.shard_engines
+
+
+def rebalance_token_sessions(batch_size: int = 500) -> int:
+    """
+    Move every token session to the shard owning its user.
+
+    Sources are the current shards, the shard files left over from a larger
+    shard count, and the main database when going from one shard to several.
+
+    Parameters:
+        batch_size: int
+
+    Returns:
+        int: The number of token sessions moved
+    """
+    columns = [
+        column.name
+        for column in user_model.TokenSession.__table__.columns
+        if column.name != "id"
+    ]
+    moved = 0
+    shards = database.ShardedSession()
+    try:
+        for source_engine in _rebalance_source_engines():
+            if not inspect(source_engine).has_table(
+                user_model.TokenSession.__tablename__
+            ):
+                continue
+            source = Session(bind=source_engine)
+            try:
+                misplaced_ids = [
+                    id_token_session
+                    for id_token_session, user_id in source.query(
+                        user_model.TokenSession.id, user_model.TokenSession.user_id
+                    )
+                    if database.shard_engines[database.shard_index(user_id)]
+                    is not source_engine
+                ]
+                for start in range(0, len(misplaced_ids), batch_size):
+                    misplaced = (
+                        source.query(user_model.TokenSession)
+                        .filter(
+                            user_model.TokenSession.id.in_(
+                                misplaced_ids[start : start + batch_size]
+                            )
+                        )
+                        .all()
+                    )
+                    for token_session in misplaced:
+                        shards.for_user(token_session.user_id).add(
+                            user_model.TokenSession(
+                                **{
+                                    name: getattr(token_session, name)
+                                    for name in columns
+                                }
+                            )
+                        )
+                    for db in shards.all():
+                        db.commit()
+                    # Only drop the source rows once the copies are committed
+                    for token_session in misplaced:
+                        source.delete(token_session)
+                    source.commit()
+                    moved += len(misplaced)
+                    logger.info(f"Moved {moved} token sessions")
+            finally:
+                source.close()
+    finally:
+        shards.close()
+    return moved
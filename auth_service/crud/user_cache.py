@@ -0,0 +1,122 @@
+import collections
+import threading
+import time
+
+import auth_service.core.config as config
+
+
+class CachedUser:
+    """
+    The fields of a user needed to issue tokens. The password hash is not
+    cached: a password change must apply at once on every worker.
+    """
+
+    __slots__ = ["id", "sub", "email", "expires_at"]
+
+    def __init__(self, id: int, sub: str, email: str, expires_at: float):
+        self.id = id
+        self.sub = sub
+        self.email = email
+        self.expires_at = expires_at
+
+
+class UserCache:
+    """
+    In-process LRU cache of users, by id and by email, with a TTL.
+    """
+
+    __slots__ = [
+        "max_size",
+        "ttl",
+        "hits",
+        "misses",
+        "_by_id",
+        "_ids_by_email",
+        "_lock",
+    ]
+
+    def __init__(self, max_size: int, ttl: float):
+        """
+        Parameters:
+            max_size: int, the maximum number of users kept
+            ttl: float, the lifetime of an entry in seconds
+        """
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._by_id: collections.OrderedDict[int, CachedUser] = (
+            collections.OrderedDict()
+        )
+        self._ids_by_email: dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._by_id)
+
+    def get_by_id(self, user_id: int) -> CachedUser | None:
+        with self._lock:
+            user = self._by_id.get(user_id)
+            if user is None or user.expires_at < time.monotonic():
+                if user is not None:
+                    self._remove(user)
+                self.misses += 1
+                return None
+            self._by_id.move_to_end(user_id)
+            self.hits += 1
+            return user
+
+    def get_by_email(self, email: str) -> CachedUser | None:
+        user_id = self._ids_by_email.get(email)
+        if user_id is None:
+            self.misses += 1
+            return None
+        return self.get_by_id(user_id)
+
+    def put(self, user) -> CachedUser:
+        """
+        Cache the given user (a model instance or any object with the same fields).
+
+        Returns:
+            CachedUser: The cached record
+        """
+        cached = CachedUser(user.id, user.sub, user.email, time.monotonic() + self.ttl)
+        with self._lock:
+            previous = self._by_id.get(cached.id)
+            if previous is not None:
+                self._remove(previous)
+            self._by_id[cached.id] = cached
+            self._ids_by_email[cached.email] = cached.id
+            while len(self._by_id) > self.max_size:
+                self._remove(next(iter(self._by_id.values())))
+        return cached
+
+    def invalidate(self, user_id: int | None = None, email: str | None = None) -> None:
+        """
+        Drop a user from the cache, to call whenever a user is created or updated.
+        """
+        with self._lock:
+            if user_id is None and email is not None:
+                user_id = self._ids_by_email.get(email)
+            user = self._by_id.get(user_id) if user_id is not None else None
+            if user is not None:
+                self._remove(user)
+            if email is not None:
+                self._ids_by_email.pop(email, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._by_id.clear()
+            self._ids_by_email.clear()
+
+    def _remove(self, user: CachedUser) -> None:
+        self._by_id.pop(user.id, None)
+        if self._ids_by_email.get(user.email) == user.id:
+            del self._ids_by_email[user.email]
+
+
+_USER_CACHE_CONFIG = config.Config().config_toml.get("user_cache", {})
+
+USER_CACHE = UserCache(
+    _USER_CACHE_CONFIG.get("max_size", 10000), _USER_CACHE_CONFIG.get("ttl", 300)
+)
@@ -1,5 +1,9 @@
+import os
+import zlib
+
+from fastapi import Depends
 from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker, declarative_base
+from sqlalchemy.orm import sessionmaker, declarative_base, Session
 from auth_service.core.config import Config
 
 
@@ -13,6 +17,86 @@ engine = create_engine(
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 Base = declarative_base()
 
+SESSION_SHARD_COUNT = Config().session_shards
+
+
+def shard_database_path(index: int | str) -> str:
+    """
+    Return the path of the database file holding the given session shard.
+    """
+    root, ext = os.path.splitext(Config().database_path)
+    return f"{root}.sessions.{index}{ext or '.db'}"
+
+
+def _create_shard_engine(index: int):
+    return create_engine(
+        f"sqlite:///{shard_database_path(index)}",
+        connect_args={"check_same_thread": False},
+    )
+
+
+# With a single shard, token sessions stay in the main database
+shard_engines = (
+    [engine]
+    if SESSION_SHARD_COUNT == 1
+    else [_create_shard_engine(i) for i in range(SESSION_SHARD_COUNT)]
+)
+ShardSessionLocal = [
+    sessionmaker(autocommit=False, autoflush=False, bind=shard_engine)
+    for shard_engine in shard_engines
+]
+
+
+def shard_index(user_id: int, shard_count: int = SESSION_SHARD_COUNT) -> int:
+    """
+    Return the index of the session shard owning the given user.
+    """
+    return zlib.crc32(str(user_id).encode("utf-8")) % shard_count
+
+
+class ShardedSession:
+    """
+    Sessions on the token session shards, opened lazily on first use.
+
+    With a single shard, the given session of the main database is used
+    instead: a request then holds one pooled connection, not two.
+    """
+
+    __slots__ = ["_sessions", "_db"]
+
+    def __init__(self, db: Session | None = None):
+        self._sessions: dict[int, Session] = {}
+        self._db = db if SESSION_SHARD_COUNT == 1 else None
+
+    def shard(self, index: int) -> Session:
+        if self._db is not None:
+            return self._db
+        if index not in self._sessions:
+            self._sessions[index] = ShardSessionLocal[index]()
+        return self._sessions[index]
+
+    def for_user(self, user_id: int) -> Session:
+        return self.shard(shard_index(user_id))
+
+    def all(self):
+        for index in range(SESSION_SHARD_COUNT):
+            yield self.shard(index)
+
+    def route(self, user_id: int | None):
+        """
+        Sessions of the shards that may hold a row of the given user: its own
+        shard when the user is known, every shard otherwise.
+        """
+        if user_id is not None:
+            yield self.for_user(user_id)
+        else:
+            yield from self.all()
+
+    def close(self) -> None:
+        for session in self._sessions.values():
+            session.close()
+        self._sessions.clear()
+
 
 def get_db():
     db = SessionLocal()
@@ -20,3 +104,11 @@ def get_db():
         yield db
     finally:
         db.close()
+
+
+def get_shards(db: Session = Depends(get_db)):
+    shards = ShardedSession(db)
+    try:
+        yield shards
+    finally:
+        shards.close()
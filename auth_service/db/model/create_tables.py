@@ -1,6 +1,13 @@
-from auth_service.db.database import engine
+from auth_service.db.database import engine, shard_engines
 from auth_service.db.model import user
 
 
 def create_all() -> None:
     user.Base.metadata.create_all(bind=engine)
+    for shard_engine in shard_engines:
+        user.Base.metadata.create_all(
+            bind=shard_engine, tables=[user.TokenSession.__table__]
+        )
+        # create_all does not add new indexes to existing tables
+        for index in user.TokenSession.__table__.indexes:
+            index.create(bind=shard_engine, checkfirst=True)
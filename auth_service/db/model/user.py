@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, ForeignKey, DateTime
+from sqlalchemy import Column, Integer, String, ForeignKey, DateTime, Index
 from sqlalchemy.orm import relationship
 from sqlalchemy.ext.declarative import declarative_base
 
@@ -16,6 +16,10 @@ class User(Base):
 
 class TokenSession(Base):
     __tablename__ = "token_sessions"
+    __table_args__ = (
+        # Sessions of a user, oldest first
+        Index("ix_token_sessions_user_id_created_at", "user_id", "created_at"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     uuid_refresh_token = Column(String, index=True)
@@ -4,23 +4,30 @@ import logging
 from fastapi import FastAPI, Query, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import HTMLResponse
-from apscheduler.schedulers.background import BackgroundScheduler
 
 import auth_service.crud.user as crud
 import auth_service.api.auth as auth_api
-from auth_service.db.database import get_db
+import auth_service.api.profiling as profiling_api
 import auth_service.db.model.create_tables
 import auth_service.core.auth as auth_core
 import auth_service.core.config as config_util
+from auth_service.core.scheduler import Scheduler
+from auth_service.core.audit import AUDIT_LOG
+import auth_service.core.profiling as profiling_core
+from auth_service.core.admission import ADMISSION_CONTROL, AdmissionMiddleware
 
 logger = logging.getLogger(__name__)
 
 application = FastAPI()
-scheduler = BackgroundScheduler()
 
 # Load the config
 CONFIG = config_util.Config().config_toml
 
+scheduler = Scheduler(
+    os.path.join(os.path.dirname(config_util.Config().database_path), "scheduler.lock")
+)
+scheduler.add_job(crud.delete_token_session_expired_in_shards, 10 * 60)
+
 # Use the values from the config file
 allow_origins = CONFIG.get("fastapi", {}).get(
     "allow_origins", ["http://localhost:8000/*"]
@@ -30,6 +37,10 @@ ALLOWED_REDIRECT_URLS = tuple(
     CONFIG.get("auth", {}).get("allowed_redirect_urls", ["http://localhost:8000/*"])
 )
 
+# Added before CORS so that the 503 responses carry the CORS headers
+if ADMISSION_CONTROL.enabled:
+    application.add_middleware(AdmissionMiddleware, admission=ADMISSION_CONTROL)
+
 application.add_middleware(
     CORSMiddleware,
     allow_origins=allow_origins,
@@ -40,23 +51,30 @@ application.add_middleware(
 
 application.include_router(auth_api.router)
 
+# The profiler is only installed when enabled, so that it costs nothing otherwise
+if profiling_core.PROFILING_CONFIG.get("enabled", False):
+    application.add_middleware(
+        profiling_core.ProfilingMiddleware,
+        store=profiling_core.PROFILE_STORE,
+        sample_rate=profiling_core.PROFILING_CONFIG.get("sample_rate", 0.0),
+        interval=profiling_core.PROFILING_CONFIG.get("interval", 0.001),
+    )
+    application.include_router(profiling_api.router)
+
 
 @application.on_event("startup")
 async def startup_event():
     logger.info("Starting up...")
 
-    def local_delete_token_session_expired():
-        db = next(get_db())
-        crud.delete_token_session_expired(db)
-
-    scheduler.add_job(local_delete_token_session_expired, "interval", minutes=10)
     scheduler.start()
+    AUDIT_LOG.start()
     auth_service.db.model.create_tables.create_all()
 
 
 @application.on_event("shutdown")
 async def shutdown_event():
-    scheduler.shutdown()
+    await scheduler.shutdown()
+    await AUDIT_LOG.close()
 
 
 @application.get("/")
@@ -64,6 +82,11 @@ async def root():
     return {"health": "ok"}
 
 
+@application.get("/admission")
+async def admission():
+    return ADMISSION_CONTROL.stats()
+
+
 @application.get("/login", tags=["html"], response_class=HTMLResponse)
 async def login(
     redirect_url: str | None = Query(
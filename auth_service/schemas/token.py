@@ -35,3 +35,17 @@ class LoginCode(pydantic.BaseModel):
 class RefreshTokenData(pydantic.BaseModel):
     uuid: str
     expires_at: datetime
+
+
+class TokenSessionInfo(pydantic.BaseModel):
+    id: int
+    created_at: datetime
+    access_token_expires_at: datetime
+    refresh_token_expires_at: datetime
+
+    class Config:
+        from_attributes = True
+
+
+class SessionsRevoked(pydantic.BaseModel):
+    revoked: int
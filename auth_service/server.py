@@ -0,0 +1,222 @@
+"""
+Production server (hypercorn) configuration and benchmark.
+"""
+
+import asyncio
+import logging
+import multiprocessing
+import os
+import socket
+import statistics
+import time
+
+from hypercorn.config import Config as HypercornConfig
+
+from auth_service.core.config import Config as auth_config
+
+logger = logging.getLogger(__name__)
+
+# Options of the [server] section passed as is to hypercorn
+HYPERCORN_OPTIONS = (
+    "bind",
+    "backlog",
+    "keep_alive_timeout",
+    "read_timeout",
+    "graceful_timeout",
+    "h11_max_incomplete_size",
+    "h2_max_concurrent_streams",
+    "h2_max_header_list_size",
+    "h2_max_inbound_frame_size",
+    "max_app_queue_size",
+    "alpn_protocols",
+    "ciphers",
+)
+
+EVENT_LOOPS = ("asyncio", "uvloop")
+
+
+class ServerConfig(HypercornConfig):
+    """
+    Hypercorn configuration with control over TLS session resumption.
+    """
+
+    # Number of TLS 1.3 session tickets sent after a handshake, 0 disables them
+    tls_session_tickets: int | None = None
+
+    def create_ssl_context(self):
+        context = super().create_ssl_context()
+        if context is not None and self.tls_session_tickets is not None:
+            context.num_tickets = self.tls_session_tickets
+        return context
+
+
+def server_options() -> dict:
+    """
+    Return the options of the [server] section of the config file.
+    """
+    options = dict(auth_config().config_toml.get("server", {}))
+    options.pop("bench", None)
+    return options
+
+
+def build_config(options: dict) -> ServerConfig:
+    """
+    Build the hypercorn configuration from the [server] options.
+
+    Parameters:
+        options: dict
+
+    Returns:
+        ServerConfig: The hypercorn configuration
+    """
+    extra = {"event_loop", "tls_session_tickets"}
+    unknown = set(options) - set(HYPERCORN_OPTIONS) - extra
+    if unknown:
+        raise ValueError(f"Unknown [server] options: {', '.join(sorted(unknown))}")
+
+    config = ServerConfig()
+    config.bind = ["0.0.0.0:443"]
+    config.loglevel = "INFO"
+    config.accesslog = "-"
+    config.errorlog = "-"
+    config.keyfile = auth_config().keyfile
+    config.certfile = auth_config().certfile
+    for name in HYPERCORN_OPTIONS:
+        if name in options:
+            setattr(config, name, options[name])
+    config.tls_session_tickets = options.get("tls_session_tickets")
+
+    assert os.path.exists(config.keyfile), f"Key file {config.keyfile} does not exist"
+    assert os.path.exists(
+        config.certfile
+    ), f"Cert file {config.certfile} does not exist"
+    return config
+
+
+def _loop_factory(event_loop: str):
+    if event_loop not in EVENT_LOOPS:
+        raise ValueError(f"Unknown event loop: {event_loop}")
+    if event_loop == "uvloop":
+        try:
+            import uvloop
+        except ImportError:
+            raise ImportError("uvloop is not installed, run: pip install .[uvloop]")
+        return uvloop.new_event_loop
+    return None
+
+
+def run(options: dict) -> None:
+    """
+    Serve the application with the given [server] options until a shutdown
+    signal, then drain the connections for at most `graceful_timeout` seconds.
+    """
+    from hypercorn.asyncio import serve
+    from auth_service.fastapi_app import application
+
+    config = build_config(options)
+    asyncio.run(
+        serve(application, config),
+        loop_factory=_loop_factory(options.get("event_loop", "asyncio")),
+    )
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _wait_for_port(
+    port: int, process: multiprocessing.Process, timeout: float = 10.0
+) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if not process.is_alive():
+            raise RuntimeError(f"Server exited with code {process.exitcode}")
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=0.5):
+                return
+        except OSError:
+            time.sleep(0.1)
+    raise TimeoutError(f"Server did not start on port {port}")
+
+
+async def _load(
+    url: str, connections: int, streams: int, duration: float
+) -> list[float]:
+    import httpx
+
+    latencies = []
+    deadline = time.monotonic() + duration
+
+    async def stream(client: httpx.AsyncClient) -> None:
+        while time.monotonic() < deadline:
+            start = time.perf_counter()
+            response = await client.get(url)
+            response.raise_for_status()
+            latencies.append(time.perf_counter() - start)
+
+    # One client per connection, several concurrent h2 streams on each
+    clients = [httpx.AsyncClient(http2=True, verify=False) for _ in range(connections)]
+    try:
+        await asyncio.gather(
+            *(stream(client) for client in clients for _ in range(streams))
+        )
+    finally:
+        await asyncio.gather(*(client.aclose() for client in clients))
+    return latencies
+
+
+def bench(connections: int, streams: int, duration: float) -> dict[str, dict]:
+    """
+    Compare the server configurations of the [server.bench.<name>] sections.
+
+    Each profile overrides the [server] options; the server is started on a
+    local port and loaded with `connections` HTTP/2 connections carrying
+    `streams` concurrent requests each, for `duration` seconds.
+
+    Returns:
+        dict[str, dict]: The requests per second and latencies per profile,
+            or the error of the profiles which could not be run
+    """
+    base_options = server_options()
+    profiles = auth_config().config_toml.get("server", {}).get("bench", {})
+    if not profiles:
+        profiles = {"default": {}}
+
+    results = {}
+    for name, overrides in profiles.items():
+        options = {**base_options, **overrides}
+        try:
+            # Fail fast in this process on a missing event loop
+            _loop_factory(options.get("event_loop", "asyncio"))
+            results[name] = _bench_profile(options, connections, streams, duration)
+        except Exception as e:
+            results[name] = {"error": str(e)}
+            logger.error(f"{name}: {e}")
+            continue
+        logger.info(f"{name}: {results[name]}")
+    return results
+
+
+def _bench_profile(
+    options: dict, connections: int, streams: int, duration: float
+) -> dict:
+    port = _free_port()
+    options = {**options, "bind": [f"127.0.0.1:{port}"]}
+    process = multiprocessing.Process(target=run, args=(options,))
+    process.start()
+    try:
+        _wait_for_port(port, process)
+        latencies = asyncio.run(
+            _load(f"https://127.0.0.1:{port}/", connections, streams, duration)
+        )
+    finally:
+        process.terminate()
+        process.join()
+    quantiles = statistics.quantiles(latencies, n=100)
+    return {
+        "requests_per_second": len(latencies) / duration,
+        "p50_ms": quantiles[49] * 1000,
+        "p99_ms": quantiles[98] * 1000,
+    }
@@ -0,0 +1,11 @@
+import os
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SECRET_KEY = "0123456789abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ01"
+
+# The configuration is read once, when auth_service is first imported
+os.environ["SECRET_KEY"] = SECRET_KEY
+os.environ["DATABASE_PATH"] = os.path.join(tempfile.mkdtemp(), "auth.db")
+os.environ["SESSION_SHARDS"] = "1"
+os.environ["AUTH_SERVICE_CONFIG"] = os.path.join(ROOT, "config.toml")
@@ -0,0 +1,102 @@
+import asyncio
+
+import pytest
+
+from auth_service.core.admission import (
+    AdaptiveLimiter,
+    AdmissionControl,
+    AdmissionMiddleware,
+)
+
+LANES = {
+    "interactive": {
+        "priority": 0,
+        "routes": ["GET /me"],
+        "target_latency": 0.05,
+        "initial_limit": 10,
+    },
+    "expensive": {
+        "priority": 1,
+        "routes": ["POST /token"],
+        "target_latency": 0.5,
+        "initial_limit": 10,
+    },
+}
+
+
+def test_limit_grows_by_one_per_window_of_successes():
+    limiter = AdaptiveLimiter("lane", initial_limit=4, max_limit=6)
+    for _ in range(4):
+        limiter.on_success()
+    assert 4.5 < limiter.limit < 5
+    for _ in range(100):
+        limiter.on_success()
+    assert limiter.limit == 6
+
+
+def test_limit_backs_off_once_per_target_latency():
+    limiter = AdaptiveLimiter("lane", target_latency=1.0, initial_limit=10, min_limit=8)
+    limiter.on_overload(100.0)
+    assert limiter.limit == 9
+    limiter.on_overload(100.5)
+    assert limiter.limit == 9
+    limiter.on_overload(101.0)
+    assert limiter.limit == pytest.approx(8.1)
+    limiter.on_overload(102.0)
+    assert limiter.limit == 8
+
+
+def test_slow_requests_shed_lower_priority_lanes_first():
+    admission = AdmissionControl(LANES)
+    admission.observe(admission.lane("POST", "/token"), 1.0)
+    assert admission.lanes["interactive"].limit == 10
+    assert admission.lanes["expensive"].limit == 9
+
+    admission = AdmissionControl(LANES)
+    admission.observe(admission.lane("GET", "/me"), 1.0)
+    assert admission.lanes["interactive"].limit == 9
+    assert admission.lanes["expensive"].limit == 9
+
+    admission = AdmissionControl(LANES)
+    admission.observe(admission.lane("GET", "/me"), 0.01)
+    assert admission.lanes["interactive"].limit == pytest.approx(10.1)
+    assert admission.lanes["expensive"].limit == 10
+
+
+def test_requests_over_the_limit_get_a_503():
+    lanes = {"expensive": {**LANES["expensive"], "initial_limit": 1}}
+    admission = AdmissionControl(lanes, retry_after=3)
+    started = asyncio.Event()
+    finish = asyncio.Event()
+
+    async def app(scope, receive, send):
+        started.set()
+        await finish.wait()
+        await send({"type": "http.response.start", "status": 200, "headers": []})
+        await send({"type": "http.response.body", "body": b""})
+
+    middleware = AdmissionMiddleware(app, admission)
+    scope = {"type": "http", "method": "POST", "path": "/token"}
+
+    async def call() -> list[dict]:
+        messages = []
+
+        async def send(message):
+            messages.append(message)
+
+        await middleware(scope, None, send)
+        return messages
+
+    async def main():
+        first = asyncio.create_task(call())
+        await started.wait()
+        rejected = await call()
+        finish.set()
+        return await first, rejected
+
+    admitted, rejected = asyncio.run(main())
+    assert admitted[0]["status"] == 200
+    assert rejected[0]["status"] == 503
+    assert (b"retry-after", b"3") in rejected[0]["headers"]
+    assert admission.lanes["expensive"].stats()["shed"] == 1
+    assert admission.lanes["expensive"].in_flight == 0
@@ -0,0 +1,101 @@
+import asyncio
+import uuid
+
+import pytest
+
+pytest.importorskip("sqlalchemy")
+httpx = pytest.importorskip("httpx")
+
+import auth_service.db.model.create_tables
+from auth_service.fastapi_app import application
+
+auth_service.db.model.create_tables.create_all()
+
+PASSWORD = "correct horse battery staple"
+
+
+def _client() -> httpx.AsyncClient:
+    return httpx.AsyncClient(
+        transport=httpx.ASGITransport(app=application), base_url="http://test"
+    )
+
+
+async def _register(client: httpx.AsyncClient) -> str:
+    email = f"{uuid.uuid4().hex}@example.com"
+    response = await client.post(
+        "/register", json={"email": email, "password": PASSWORD}
+    )
+    assert response.status_code == 200
+    return email
+
+
+async def _token(client: httpx.AsyncClient, email: str) -> httpx.Response:
+    return await client.post("/token", data={"username": email, "password": PASSWORD})
+
+
+def test_concurrent_logins():
+    async def main():
+        async with _client() as client:
+            email = await _register(client)
+            return await asyncio.wait_for(
+                asyncio.gather(*(_token(client, email) for _ in range(30))), 30
+            )
+
+    # The logins over the limit of the lane are shed at once, none waits on
+    # the database pool
+    statuses = [response.status_code for response in asyncio.run(main())]
+    assert set(statuses) <= {200, 503}
+    assert 200 in statuses
+
+
+def test_cheap_routes_flow_during_a_login():
+    async def main():
+        async with _client() as client:
+            email = await _register(client)
+            token = (await _token(client, email)).json()["access_token"]
+            login = asyncio.create_task(_token(client, email))
+            served = 0
+            while not login.done():
+                response = await client.get(
+                    "/me", headers={"Authorization": f"Bearer {token}"}
+                )
+                assert response.status_code == 200
+                served += 1
+                await asyncio.sleep(0.01)
+            assert (await login).status_code == 200
+            return served
+
+    # bcrypt runs in a thread, the event loop keeps serving /me meanwhile
+    assert asyncio.run(main()) > 5
+
+
+def test_concurrent_refreshes_share_one_rotation():
+    async def main():
+        async with _client() as client:
+            email = await _register(client)
+            refresh_token = (await _token(client, email)).json()["refresh_token"]
+            headers = {"Authorization": f"Bearer {refresh_token}"}
+            return await asyncio.gather(
+                *(client.post("/refresh", headers=headers) for _ in range(8))
+            )
+
+    responses = asyncio.run(main())
+    assert [response.status_code for response in responses] == [200] * 8
+    assert len({response.json()["refresh_token"] for response in responses}) == 1
+
+
+def test_access_token_is_rejected_after_logout():
+    async def main():
+        async with _client() as client:
+            email = await _register(client)
+            token = (await _token(client, email)).json()["access_token"]
+            headers = {"Authorization": f"Bearer {token}"}
+            assert (await client.get("/me", headers=headers)).status_code == 200
+            assert (await client.get("/sessions", headers=headers)).status_code == 200
+
+            response = await client.post("/logout", headers=headers)
+            assert response.status_code == 204
+            assert (await client.get("/me", headers=headers)).status_code == 401
+            assert (await client.get("/sessions", headers=headers)).status_code == 401
+
+    asyncio.run(main())
@@ -0,0 +1,101 @@
+import asyncio
+
+import pytest
+
+from auth_service.core.coalescing import SingleFlight
+
+
+class Counter:
+    """
+    A computation counting its calls, running until `release` is set.
+    """
+
+    def __init__(self, error: Exception | None = None):
+        self.calls = 0
+        self.error = error
+        self.release = asyncio.Event()
+
+    async def __call__(self) -> int:
+        self.calls += 1
+        await self.release.wait()
+        if self.error is not None:
+            raise self.error
+        return self.calls
+
+
+async def _concurrent(flight: SingleFlight, func: Counter, n: int) -> list:
+    callers = [asyncio.ensure_future(flight.do("key", func)) for _ in range(n)]
+    await asyncio.sleep(0)
+    func.release.set()
+    return await asyncio.gather(*callers, return_exceptions=True)
+
+
+@pytest.mark.parametrize("grace", [0, 10])
+def test_concurrent_calls_run_once(grace):
+    async def main():
+        flight = SingleFlight(grace)
+        func = Counter()
+        assert await _concurrent(flight, func, 8) == [1] * 8
+        assert func.calls == 1
+
+    asyncio.run(main())
+
+
+def test_exceptions_are_shared_but_not_replayed():
+    async def main():
+        flight = SingleFlight(10)
+        func = Counter(ValueError("invalid"))
+        results = await _concurrent(flight, func, 4)
+        assert all(isinstance(result, ValueError) for result in results)
+        assert func.calls == 1
+
+        with pytest.raises(ValueError):
+            await flight.do("key", func)
+        assert func.calls == 2
+
+    asyncio.run(main())
+
+
+def test_results_are_replayed_during_the_grace_period():
+    async def main():
+        flight = SingleFlight(0.1)
+        func = Counter()
+        func.release.set()
+        assert await flight.do("key", func) == 1
+        assert await flight.do("key", func) == 1
+        assert await flight.do("other", func) == 2
+
+        await asyncio.sleep(0.15)
+        assert await flight.do("key", func) == 3
+
+    asyncio.run(main())
+
+
+def test_no_replay_without_grace():
+    async def main():
+        flight = SingleFlight(0)
+        func = Counter()
+        func.release.set()
+        assert await flight.do("key", func) == 1
+        assert await flight.do("key", func) == 2
+
+    asyncio.run(main())
+
+
+def test_cancelled_caller_does_not_cancel_the_others():
+    async def main():
+        flight = SingleFlight(10)
+        func = Counter()
+        first = asyncio.ensure_future(flight.do("key", func))
+        second = asyncio.ensure_future(flight.do("key", func))
+        await asyncio.sleep(0)
+        first.cancel()
+        await asyncio.sleep(0)
+        func.release.set()
+
+        assert await second == 1
+        with pytest.raises(asyncio.CancelledError):
+            await first
+        assert func.calls == 1
+
+    asyncio.run(main())
@@ -0,0 +1,46 @@
+import asyncio
+import uuid
+
+import pytest
+
+pytest.importorskip("sqlalchemy")
+httpx = pytest.importorskip("httpx")
+
+import auth_service.core.profiling as profiling_core
+import auth_service.db.model.create_tables
+from auth_service.fastapi_app import application
+
+auth_service.db.model.create_tables.create_all()
+
+PASSWORD = "correct horse battery staple"
+
+
+def test_refresh_profile_samples_the_worker_thread():
+    store = profiling_core.ProfileStore(100)
+    app = profiling_core.ProfilingMiddleware(application, store, interval=0.0001)
+    headers = {"X-Profile-Token": profiling_core.sign_profile_token()}
+
+    async def main():
+        async with httpx.AsyncClient(
+            transport=httpx.ASGITransport(app=app), base_url="http://test"
+        ) as client:
+            email = f"{uuid.uuid4().hex}@example.com"
+            data = {"email": email, "password": PASSWORD}
+            await client.post("/register", json=data)
+            response = await client.post(
+                "/token", data={"username": email, "password": PASSWORD}
+            )
+            refresh_token = response.json()["refresh_token"]
+            # A refresh takes a few milliseconds: profile several of them
+            for _ in range(20):
+                response = await client.post(
+                    "/refresh",
+                    headers={**headers, "Authorization": f"Bearer {refresh_token}"},
+                )
+                assert response.status_code == 200
+                refresh_token = response.json()["refresh_token"]
+
+    asyncio.run(main())
+    profiles = [p for p in store.all() if p.path == "/refresh"]
+    assert len(profiles) == 20
+    assert any("_update_token_session" in p.collapsed() for p in profiles)
@@ -0,0 +1,56 @@
+import os
+import sqlite3
+import subprocess
+import sys
+
+import pytest
+
+pytest.importorskip("sqlalchemy")
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SECRET_KEY = "0123456789abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ01"
+
+CREATE_SESSIONS = """
+from datetime import datetime, timedelta, timezone
+import auth_service.crud.user as crud
+import auth_service.db.model.create_tables
+from auth_service.db.database import ShardedSession
+
+auth_service.db.model.create_tables.create_all()
+shards = ShardedSession()
+expires = datetime.now(timezone.utc) + timedelta(days=1)
+for user_id in range(1, 9):
+    crud.create_token_session(
+        shards, f"code-{user_id}", f"uuid-{user_id}", f"token-{user_id}",
+        f"refresh-{user_id}", user_id, expires, expires,
+    )
+shards.close()
+"""
+
+
+def _run(tmp_path, shards: int, *args: str) -> None:
+    env = {
+        **os.environ,
+        "DATABASE_PATH": str(tmp_path / "auth.db"),
+        "SESSION_SHARDS": str(shards),
+        "SECRET_KEY": SECRET_KEY,
+        "AUTH_SERVICE_CONFIG": os.path.join(ROOT, "config.toml"),
+    }
+    subprocess.run([sys.executable, *args], cwd=ROOT, env=env, check=True)
+
+
+def _count(path) -> int:
+    with sqlite3.connect(path) as connection:
+        return connection.execute("SELECT COUNT(*) FROM token_sessions").fetchone()[0]
+
+
+def test_rebalance_back_to_one_shard(tmp_path):
+    _run(tmp_path, 4, "-c", CREATE_SESSIONS)
+    assert sum(_count(tmp_path / f"auth.sessions.{i}.db") for i in range(4)) == 8
+
+    _run(tmp_path, 2, "-m", "auth_service", "--rebalance-sessions")
+    assert sum(_count(tmp_path / f"auth.sessions.{i}.db") for i in range(2)) == 8
+
+    _run(tmp_path, 1, "-m", "auth_service", "--rebalance-sessions")
+    assert _count(tmp_path / "auth.db") == 8
+    assert all(_count(tmp_path / f"auth.sessions.{i}.db") == 0 for i in range(4))
@@ -0,0 +1,61 @@
+import time
+
+import auth_service.core.revocation as revocation
+from auth_service.core.revocation import RevocationList
+
+
+def _lists(tmp_path, n: int = 2) -> list[RevocationList]:
+    path = str(tmp_path / "revoked_tokens.log")
+    return [RevocationList(path, 3600, sync_interval=0) for _ in range(n)]
+
+
+def _entries(revocation_list: RevocationList) -> set[str]:
+    with open(revocation_list.path) as file:
+        return {line.split()[0] for line in file}
+
+
+def test_revocations_are_visible_to_other_instances(tmp_path):
+    first, second = _lists(tmp_path)
+    first.revoke("a", int(time.time()) + 60)
+    assert second.is_revoked("a")
+    assert not second.is_revoked("b")
+    assert not second.is_revoked(None)
+
+
+def test_entries_are_pruned_at_expiry(tmp_path, monkeypatch):
+    first, second = _lists(tmp_path)
+    now = int(time.time())
+    first.revoke("a", now + 10)
+    first.revoke("b", now + 20)
+    assert second.is_revoked("a")
+
+    monkeypatch.setattr(revocation.time, "time", lambda: now + 10)
+    assert not first.is_revoked("a")
+    assert not second.is_revoked("a")
+    assert second.is_revoked("b")
+    assert len(first) == len(second) == 1
+
+
+def test_compaction_keeps_entries_appended_since_the_last_read(tmp_path, monkeypatch):
+    first, second = _lists(tmp_path)
+    now = int(time.time())
+    for i in range(2000):
+        first.revoke(f"expired-{i}", now + 5)
+    second.revoke("kept", now + 600)
+
+    # The expired entries make the file large enough to be compacted
+    monkeypatch.setattr(revocation.time, "time", lambda: now + 10)
+    first.sync()
+    assert _entries(first) == {"kept"}
+
+    # Appended by another worker while the file is being compacted
+    second.revoke("late", now + 600)
+    first._compact()
+    assert _entries(first) == {"kept", "late"}
+    assert first.is_revoked("late")
+
+    # The other worker follows the compacted file
+    first.revoke("after", now + 600)
+    assert second.is_revoked("kept")
+    assert second.is_revoked("after")
+    assert len(second) == 3